@@ -64,8 +64,9 @@ class StimulusManager(Display):
         self.frame_counter = 0
         args.update(self.initiate_stimulus_config["dots"])
         self.stimulus.new_stimulus(args)
-        if self.initiate_stimulus_config["audio"]:
-            self.play_audio(self.initiate_stimulus_config["audio"])
+        audio_name = self.initiate_stimulus_config["audio"]
+        if audio_name:
+            self.play_audio(audio_name)
 
     def update_stimulus(self, args=None):
         frame_rate = self.clock.get_fps() or self.frame_rate
@@ -105,8 +106,8 @@ class StimulusManager(Display):
     def initiate_reinforcement(self, args):
         func, arg = self.update_stimulus()
         func(arg)
-        if self.initiate_reinforcement_config["audio"][args['outcome']]:
-            audio_name = self.initiate_reinforcement_config["audio"][args['outcome']]
+        audio_name = self.initiate_reinforcement_config["audio"][args['outcome']]
+        if audio_name:
             self.play_audio(audio_name)
 
     def update_reinforcement(self, args=None):
@@ -193,5 +194,5 @@ def main():
 if __name__ == "__main__":
     import multiprocessing
     
-    game = multiprocessing.Process(target=main())
+    game = multiprocessing.Process(target=main)
     game.start()
@@ -1,13 +1,63 @@
 import csv
-import multiprocessing as mp
+import math
 import numpy as np
+import operator
+import os
 import pickle
-import pandas as pd
 
 #TODO: 1. Use subject_config["session_uuid"] instead of subject name for file naming
 #TODO: 5. Make sure graduation is working properly
 #TODO: 6. Activate sound on display
 
+# reward volume limits and per-adjustment step (in ul)
+REWARD_VOLUME_MIN = 1.5
+REWARD_VOLUME_MAX = 3.5
+REWARD_VOLUME_STEP = 0.1
+# session-start reward adjustment: one step up for each threshold the subject is below,
+# one step down if the previous session had more attempts than ATTEMPT_THRESHOLD
+WEIGHT_THRESHOLDS = (85, 80) # % of baseline weight
+TOTAL_REWARD_THRESHOLDS = (700, 500) # ul given in previous session
+ATTEMPT_THRESHOLD = 200
+TRIAL_FLUSH_INTERVAL = 20 # trial file is flushed to disk at least every this many trials
+RNG_POOL_SIZE = 1024 # per-trial random draws are generated in batches of this size
+
+# trial outcomes in the order of their per-outcome function tuples
+OUTCOMES = ("noresponse", "correct", "incorrect")
+NORESPONSE, CORRECT, INCORRECT = (OUTCOMES.index(outcome) for outcome in ("noresponse", "correct", "incorrect"))
+# numeric code stored for each trial outcome
+OUTCOME_CODES = {"correct": 1, "incorrect": 0, "noresponse": np.NaN}
+
+# columns of the trial data file, in the order they are written:
+# (column, trial_counters key) pairs followed by (column, SessionManager attribute) pairs
+TRIAL_COUNTER_COLUMNS = (
+    ("idx_attempt", "attempt"),
+    ("idx_valid", "valid"),
+    ("idx_correction", "correction"),
+)
+TRIAL_ATTRIBUTE_COLUMNS = (
+    ("is_correction_trial", "is_correction_trial"),
+    ("signed_coherence", "signed_coherence"),
+    ("target", "target"),
+    ("choice", "choice"),
+    ("response_time", "response_time"),
+    ("is_valid", "valid"),
+    ("outcome", "outcome"),
+    ("trial_reward", "trial_reward"),
+    ("fixation_duration", "fixation_duration"),
+    ("stimulus_duration", "stimulus_duration"),
+    ("reinforcement_duration", "reinforcement_duration"),
+    ("delay_duration", "delay_duration"),
+    ("intertrial_duration", "intertrial_duration"),
+    ("fixation_onset", "fixation_onset"),
+    ("stimulus_onset", "stimulus_onset"),
+    ("response_onset", "response_onset"),
+    ("reinforcement_onset", "reinforcement_onset"),
+    ("delay_onset", "delay_onset"),
+    ("intertrial_onset", "intertrial_onset"),
+    ("stimulus_seed", "random_generator_seed"),
+)
+TRIAL_FIELDNAMES = tuple(column for column, _ in TRIAL_COUNTER_COLUMNS + TRIAL_ATTRIBUTE_COLUMNS)
+
 
 class SessionManager:
     """
@@ -36,7 +86,7 @@ class SessionManager:
         self.response_time = None
         self.valid = None
         self.outcome = None
-        self.full_reward_volume = self.config.SUBJECT["rolling_perf"]["reward_volume"]
+        self.full_reward_volume = float(self.config.SUBJECT["rolling_perf"]["reward_volume"])
         self.update_reward_volume()
         self.trial_reward = None # reward given on current trial
         self.total_reward = 0 # total reward given in session
@@ -58,133 +108,163 @@ class SessionManager:
         # behavior dependent function
         self.fixation_duration_function = self.config.TASK["epochs"]["fixation"]["duration"]
         self.passive_viewing_function = self.config.TASK["epochs"]["stimulus"]["passive_viewing"]
-        self.reinforcement_duration_function = self.config.TASK["epochs"]["reinforcement"]["duration"]
-        self.delay_duration_function = self.config.TASK["epochs"]["delay"]["duration"]
+        # outcome-specific duration functions indexed like OUTCOMES, looked up once instead of every trial
+        reinforcement_duration_function = self.config.TASK["epochs"]["reinforcement"]["duration"]
+        delay_duration_function = self.config.TASK["epochs"]["delay"]["duration"]
+        self._reinforcement_duration_functions = tuple(reinforcement_duration_function[outcome] for outcome in OUTCOMES)
+        self._delay_duration_functions = tuple(delay_duration_function[outcome] for outcome in OUTCOMES)
+        self._outcome_index = None
         # initialize session variables
         self.full_coherences = self.config.TASK["stimulus"]["signed_coherences"]["value"]
-        self.coh_to_xrange = {coh: i for i, coh in enumerate(self.full_coherences)}
+        # coherence index lookup, keyed by python int to match signed_coherence
+        self.coh_to_xrange = {int(coh): i for i, coh in enumerate(self.full_coherences)}
+        self._coh_strs = [str(coh) for coh in self.full_coherences] # rolling_perf keys by coherence index
         self.training_type = self.config.TASK["training_type"]["value"]
+        self.prepare_stimulus_stage = (
+            self.prepare_passive_stimulus_stage,
+            self.prepare_active_passive_stimulus_stage,
+            self.prepare_active_stimulus_stage,
+        )[self.training_type]
         # trial block
+        self._rng = np.random.default_rng()
+        self._refill_pools()
         self.block_schedule = []
+        self._block_len = 0
         self.trials_in_block = 0
         self.current_coh_level = self.config.SUBJECT["rolling_perf"]["current_coherence_level"]
         self.repeats_per_block = self.config.TASK["stimulus"]["repeats_per_block"]["value"]
         self.active_coherences = self.config.TASK["stimulus"]["active_coherences"]["value"]
-        self.active_coherence_indices = [np.where(self.full_coherences == value)[0][0] for value in self.active_coherences]
+        self.active_coherence_indices = np.array(
+            [self.coh_to_xrange[int(coh)] for coh in self.active_coherences], dtype=np.int32
+        )
         # rolling performance
         self.rolling_history_indices = self.config.SUBJECT["rolling_perf"]["history_indices"]
         self.rolling_history = self.config.SUBJECT["rolling_perf"]["history"]
         self.rolling_accuracy = self.config.SUBJECT["rolling_perf"]["accuracy"]
         self.rolling_window = self.config.TASK["rolling_performance"]["rolling_window"]
+        # per-trial updates go to one (coherence x window) array indexed by coh_to_xrange,
+        # packed back into the rolling_perf dicts in end_of_session_updates
+        self._rolling_hist = np.array([self.rolling_history[coh_str] for coh_str in self._coh_strs])
+        self._rolling_idx = np.array([self.rolling_history_indices[coh_str] for coh_str in self._coh_strs])
+        # running count of correct trials in each window; accuracy divides by the stored history
+        # length (not rolling_window) so it matches np.mean over a history from an older window size
+        self._rolling_sum = self._rolling_hist.sum(axis=1)
         # bias
         self.rolling_bias_index = 0
         self.bias_window = self.config.TASK["bias_correction"]["bias_window"]
-        self.rolling_bias = np.zeros(self.bias_window)
+        self.rolling_bias = np.zeros(self.bias_window, dtype=np.int8) # ring buffer of choices (-1: left, 1: right)
+        self._bias_sum = 0 # running sum of rolling_bias
         self.passive_bias_correction_threshold = self.config.TASK["bias_correction"]["repeat_threshold"]["passive"]
         self.active_bias_correction_threshold = self.config.TASK["bias_correction"]["repeat_threshold"]["active"]
         # graduation parameters
         self.trials_in_current_level = self.config.SUBJECT["rolling_perf"]["trials_in_current_level"]
         self.next_coh_level = self.current_coh_level
-        self.active_coherences = self.config.TASK["stimulus"]["active_coherences"]["value"]
-        self.active_coherence_indices = [np.where(self.full_coherences == value)[0][0] for value in self.active_coherences]
 
         # plot variables
         self.plot_vars = {
             "running_accuracy": [],
-            "chose_right": {int(coh): 0 for coh in self.full_coherences},
-            "chose_left": {int(coh): 0 for coh in self.full_coherences},
-            "psych": {int(coh): np.NaN for coh in self.full_coherences},
-            "trial_distribution": {int(coh): 0 for coh in self.full_coherences},
-            "response_time_distribution": {int(coh): np.NaN for coh in self.full_coherences},
         }
-
-        # list of all variables needed to be reset every trial
-        self.trial_reset_variables = [
-            self.random_generator_seed,
-            self.signed_coherence,
-            self.target,
-            self.choice,
-            self.response_time,
-            self.valid,
-            self.outcome,
-            self.trial_reward,
+        # per-coherence plot arrays (indexed by coh_to_xrange), sent to the terminal as dicts keyed by int(coh)
+        self._plot_keys = [int(coh) for coh in self.full_coherences]
+        self._chose_right = np.zeros(len(self.full_coherences), dtype=np.int32)
+        self._chose_left = np.zeros(len(self.full_coherences), dtype=np.int32)
+        self._psych = np.full(len(self.full_coherences), np.NaN)
+        self._trial_distribution = np.zeros(len(self.full_coherences), dtype=np.int32)
+        # running mean of response time per coherence (sample count is _trial_distribution)
+        self._rt_mean = np.zeros(len(self.full_coherences))
+
+        # names of all variables needed to be reset every trial
+        # (signed_coherence is kept since correction trials repeat the previous coherence)
+        self.trial_reset_variables = (
+            "random_generator_seed",
+            "target",
+            "choice",
+            "response_time",
+            "valid",
+            "outcome",
+            "trial_reward",
             # time related dynamic variables
-            self.fixation_duration,
-            self.stimulus_duration,
-            self.reinforcement_duration,
-            self.delay_duration,
+            "fixation_duration",
+            "stimulus_duration",
+            "reinforcement_duration",
+            "delay_duration",
             # epoch onsets
-            self.fixation_onset,
-            self.stimulus_onset,
-            self.response_onset,
-            self.reinforcement_onset,
-            self.delay_onset,
-            self.intertrial_onset,
-        ]
+            "fixation_onset",
+            "stimulus_onset",
+            "response_onset",
+            "reinforcement_onset",
+            "delay_onset",
+            "intertrial_onset",
+        )
+        self._trial_reset_values = dict.fromkeys(self.trial_reset_variables)
+
+        # trial data row getters, built from the same tables as TRIAL_FIELDNAMES
+        self._trial_row_counters = operator.itemgetter(*(key for _, key in TRIAL_COUNTER_COLUMNS))
+        self._trial_row_values = operator.attrgetter(*(attribute for _, attribute in TRIAL_ATTRIBUTE_COLUMNS))
+        # trial data file is kept open for the whole session and closed in end_of_session_updates
+        self._trial_file = open(self.config.FILES["trial"], "a", newline="", buffering=1 << 16)
+        self._trial_writer = csv.writer(self._trial_file)
+        if self._trial_file.tell() == 0:
+            self._trial_writer.writerow(TRIAL_FIELDNAMES)
+        self._unflushed_trials = 0
 
     ####################### pre-session methods #######################
     def update_reward_volume(self):
         # function to update reward volume based on weight and previous session performance
-        ## weight based reward adjustment
-        # % baseline weight is below 85% increase reward by 0.1 ul
-        if self.config.SUBJECT["prct_weight"] < 85:
-            self.full_reward_volume += 0.1
-        # if % baseline weight is below 80% increase reward by another 0.1 ul
-        if self.config.SUBJECT["prct_weight"] < 80:
-            self.full_reward_volume += 0.1
-
-        ## reward volume based reward adjustment
-        if self.config.SUBJECT["rolling_perf"]["total_reward"] < 700:
-            self.full_reward_volume += 0.1
-            if self.config.SUBJECT["rolling_perf"]["total_reward"] < 500:
-                self.full_reward_volume += 0.1
-
+        prct_weight = self.config.SUBJECT["prct_weight"]
+        rolling_perf = self.config.SUBJECT["rolling_perf"]
+        ## weight and reward volume based increase
+        # e.g., % baseline weight below 85% increases reward by 0.1 ul, below 80% by another 0.1 ul
+        steps = sum(prct_weight < threshold for threshold in WEIGHT_THRESHOLDS)
+        steps += sum(rolling_perf["total_reward"] < threshold for threshold in TOTAL_REWARD_THRESHOLDS)
         ## Attempt based reward adjustment
         # if performed more than 200 trials on previous session, decrease reward by 0.1 ul
-        if self.config.SUBJECT["rolling_perf"]["total_attempts"] > 200:
-            self.full_reward_volume -= 0.1 
+        steps -= rolling_perf["total_attempts"] > ATTEMPT_THRESHOLD
+        reward_volume = self.full_reward_volume + steps * REWARD_VOLUME_STEP
 
-        ## limiting reward volume between 2 and 3.5
-        self.full_reward_volume = np.clip(self.full_reward_volume, 1.5, 3.5)
+        ## limiting reward volume between 1.5 and 3.5
+        self.full_reward_volume = min(max(reward_volume, REWARD_VOLUME_MIN), REWARD_VOLUME_MAX)
 
     ####################### trial epoch methods #######################
     def prepare_fixation_stage(self):
         stage_task_args, stage_stimulus_args = {}, {}
         # resetting trial variables
-        for var in self.trial_reset_variables:
-            var = None
+        self.__dict__.update(self._trial_reset_values)
         # updating random generator seed
-        self.random_generator_seed = np.random.randint(0, 1000000)
+        if self._pool_i >= RNG_POOL_SIZE:
+            self._refill_pools()
+        self.random_generator_seed = self._seed_pool[self._pool_i]
         # updating trial parameters
         self.prepare_trial_variables()     
         # get fixation duratino
         self.fixation_duration = self.fixation_duration_function()  
         # prepare args
-        stage_stimulus_args = {}, 
+        stage_stimulus_args = {}
         stage_task_args = {"fixation_duration": self.fixation_duration, "monitor_response": [np.NaN], "signed_coherence": self.signed_coherence}
         return stage_task_args, stage_stimulus_args
 
-    def prepare_stimulus_stage(self):
-        stage_task_args, stage_stimulus_args = {}, {}
+    # prepare_stimulus_stage is bound to one of the following in __init__ based on training_type
+    def prepare_passive_stimulus_stage(self): # passive-only training
+        self.stimulus_duration = self.passive_viewing_function(self.current_coh_level)
+        #TODO: passive should not take any response
+        print(f"Passive Stimulus Duration is {self.stimulus_duration}")
+        return self.stimulus_stage_args(monitor_response=[])
+
+    def prepare_active_passive_stimulus_stage(self): # active-passive training
+        self.stimulus_duration = self.passive_viewing_function(self.current_coh_level)
+        print(f"Passive Stimulus Duration is {self.stimulus_duration}")
+        # return self.stimulus_stage_args(monitor_response=[self.target])
+        return self.stimulus_stage_args(monitor_response=[-1, 1])
+
+    def prepare_active_stimulus_stage(self): # active training
+        self.stimulus_duration = self.maximum_viewing_duration
+        return self.stimulus_stage_args(monitor_response=[-1, 1])
+
+    def stimulus_stage_args(self, monitor_response):
         stage_stimulus_args = {
             "coherence": self.signed_coherence,
             "seed": self.random_generator_seed,
         }
-
-        if self.training_type == 0: # passive-only training
-            self.stimulus_duration = self.passive_viewing_function(self.current_coh_level)
-            #TODO: passive should not take any response
-            monitor_response = []
-            print(f"Passive Stimulus Duration is {self.stimulus_duration}")
-        elif self.training_type == 1: # active-passive training
-            self.stimulus_duration = self.passive_viewing_function(self.current_coh_level)
-            # monitor_response = [self.target]
-            monitor_response = [-1, 1]
-            print(f"Passive Stimulus Duration is {self.stimulus_duration}")
-        elif self.training_type == 2: # active training
-            self.stimulus_duration = self.maximum_viewing_duration
-            monitor_response = [-1, 1]
-        
         stage_task_args = {
             "coherence": self.signed_coherence,
             "target": self.target,
@@ -200,42 +280,43 @@ class SessionManager:
         self.response_time = response_time
         
         # determining validity of the trial
-        if not self.is_correction_trial and (not np.isnan(self.choice)): # if this is not a correction trial and there is a response
+        if not self.is_correction_trial and (not math.isnan(self.choice)): # if this is not a correction trial and there is a response
             self.valid = 1 # trial is valid
         else:
             self.valid = 0 # trial is invalid            
 
         # determining outcome of the trial
-        if np.isnan(self.choice): # if no response
-            self.outcome = "noresponse"
+        if math.isnan(self.choice): # if no response
+            self._outcome_index = NORESPONSE
         elif self.choice == self.target: # if correct
-            self.outcome = "correct"
-        elif self.choice != self.target: # if incorrect
-            self.outcome = "incorrect"
+            self._outcome_index = CORRECT
+        else: # if incorrect
+            self._outcome_index = INCORRECT
+        self.outcome = OUTCOMES[self._outcome_index]
         stage_stimulus_args["outcome"] =  self.outcome
 
         # determine reinfocement duration and reward
-        self.reinforcement_duration = self.reinforcement_duration_function[self.outcome](self.response_time)
+        self.reinforcement_duration = self._reinforcement_duration_functions[self._outcome_index](self.response_time)
         if self.outcome=="correct":
             # if invalid trial (i.e., correct repeat), give half reward_volume irrespective of training type
             if self.valid:
                 self.trial_reward = self.full_reward_volume
-                self.trial_reward = max(self.trial_reward, 1.5) # making sure reward is not below 1.5 ul
+                self.trial_reward = max(self.trial_reward, REWARD_VOLUME_MIN) # making sure reward is not below 1.5 ul
 
             else:
                 # If repeat trial give half reward. Should motivate to be more accurate but 
                 # might also create bias by giving less reward on repeat trials which is most likely going to be opposite of biased direction
                 self.trial_reward = self.full_reward_volume #/ 2
-                self.trial_reward = max(self.trial_reward, 1.5) # making sure reward is not below 1ul
+                self.trial_reward = max(self.trial_reward, REWARD_VOLUME_MIN) # making sure reward is not below 1ul
         else:
             self.trial_reward = None
 
         # making changes to typical reinforcement durations and reward based on training type and trial validity
         # if no response on passive/active-passive training assume correct trial durations and give half reward_volume
         if self.training_type < 2 and self.outcome=="noresponse":
-            self.reinforcement_duration = self.reinforcement_duration_function["correct"](self.response_time)
+            self.reinforcement_duration = self._reinforcement_duration_functions[CORRECT](self.response_time)
             self.trial_reward = self.full_reward_volume / 2
-            self.trial_reward = max(self.trial_reward, 1.5) # making sure reward is not below 1.5 ul
+            self.trial_reward = max(self.trial_reward, REWARD_VOLUME_MIN) # making sure reward is not below 1.5 ul
             # msg to stimulus
             stage_stimulus_args["outcome"] = "correct"
         
@@ -252,9 +333,9 @@ class SessionManager:
         stage_task_args, stage_stimulus_args = {}, {}
 
         if self.training_type < 2 and self.outcome=="noresponse":
-            self.delay_duration = self.delay_duration_function["correct"](self.response_time)
+            self.delay_duration = self._delay_duration_functions[CORRECT](self.response_time)
         else:
-            self.delay_duration = self.delay_duration_function[self.outcome](self.response_time)
+            self.delay_duration = self._delay_duration_functions[self._outcome_index](self.response_time)
 
         stage_task_args = {"delay_duration": self.delay_duration}
         return stage_task_args, stage_stimulus_args
@@ -268,23 +349,35 @@ class SessionManager:
     def prepare_trial_variables(self):
         if not self.is_correction_trial:    # if not correction trial
             # is this start of new trial block?
-            if self.trials_in_block == 0 or self.trials_in_block == len(self.block_schedule):
+            if self.trials_in_block == 0 or self.trials_in_block >= self._block_len:
                 self.trials_in_block = 0
                 self.generate_block_schedule()
-            self.signed_coherence = self.block_schedule[self.trials_in_block]
-            self.target = int(np.sign(self.signed_coherence + np.random.choice([-1e-2, 1e-2])))
+            self.signed_coherence = int(self.block_schedule[self.trials_in_block])
+            self.target = 1 if self.signed_coherence + self._tiebreak_pool[self._pool_i] >= 0 else -1
             self.trials_in_block += 1 # incrementing within block counter
             self.trials_in_current_level += 1 # incrementing within level counter
             self.trial_counters["correction"] = 0 # resetting correction counter
         else:
             # drawing repeat trial with direction from a normal distribution with mean of against rolling bias
-            self.target = int(np.sign(np.random.normal(-np.mean(self.rolling_bias), 0.5)))
+            bias_mean = self._bias_sum / self.bias_window
+            self.target = 1 if self._rng.normal(-bias_mean, 0.5) >= 0 else -1
             # Repeat probability to opposite side of bias
-            self.signed_coherence = self.target * np.abs(self.signed_coherence)
-            print(f"Rolling choices: {self.rolling_bias} with mean {np.mean(self.rolling_bias)} \n" 
+            self.signed_coherence = self.target * abs(self.signed_coherence)
+            print(f"Rolling choices: {self.rolling_bias} with mean {bias_mean} \n" 
                     f"Passive bias correction with: {self.signed_coherence}")
             # increment correction trial counter
             self.trial_counters["correction"] += 1
+        # coherence index and rolling_perf key of this trial, used in end_of_trial_updates
+        self._coh_idx = self.coh_to_xrange[self.signed_coherence]
+        self._coh_str = self._coh_strs[self._coh_idx]
+        self._pool_i += 1
+
+
+    def _refill_pools(self):
+        """ Draw the next batch of stimulus seeds and target tie-breaks used by prepare_fixation_stage"""
+        self._seed_pool = self._rng.integers(0, 1000000, size=RNG_POOL_SIZE)
+        self._tiebreak_pool = self._rng.choice([-1e-2, 1e-2], size=RNG_POOL_SIZE)
+        self._pool_i = 0
 
 
     def generate_block_schedule(self):
@@ -292,7 +385,7 @@ class SessionManager:
         if self.trial_counters["attempt"] == 0:
             self.block_schedule = np.flip(self.block_schedule[np.argsort(np.abs(self.block_schedule))])
         else:
-            np.random.shuffle(self.block_schedule)
+            self.block_schedule = self._rng.permutation(self.block_schedule)
 
             # TODO: active bias correction needed?
             # swap coherence direction to unbiased side if coherence is above active threshold
@@ -309,15 +402,22 @@ class SessionManager:
 
             max_repeat_signs = 3
             self.block_schedule = self.shuffle_seq(self.block_schedule, max_repeat_signs)
+        self._block_len = self.block_schedule.size
 
     def shuffle_seq(self, sequence, max_repeat):
         """ Shuffle sequence so that no more than max_repeat consecutive elements have same sign"""
-        for i in range(len(sequence) - max_repeat+1):
-            subsequence = sequence[i:i + max_repeat]
-            if len(set(np.sign(subsequence))) == 1:
-                temp_block = sequence[i:]
-                np.random.shuffle(temp_block)
-                sequence[i:] = temp_block
+        signs = np.sign(sequence)
+        start = 0
+        while len(sequence) - start >= max_repeat:
+            # first window of max_repeat elements at or after start that all share a sign
+            windows = np.lib.stride_tricks.sliding_window_view(signs[start:], max_repeat)
+            same_sign = np.flatnonzero((windows == windows[:, :1]).all(axis=1))
+            if not same_sign.size:
+                break
+            i = start + same_sign[0]
+            self._rng.shuffle(sequence[i:])
+            signs[i:] = np.sign(sequence[i:])
+            start = i + 1
         return sequence
 
 
@@ -326,33 +426,26 @@ class SessionManager:
     def end_of_trial_updates(self):
         # function to finalize current trial and set parameters for next trial
         # codify trial outcome
-        if self.outcome == "correct":
-            self.outcome = 1
-        elif self.outcome == "incorrect":
-            self.outcome = 0
-        elif self.outcome == "noresponse":
-            self.outcome = np.NaN
+        outcome = self.outcome
+        self.outcome = OUTCOME_CODES[outcome]
 
         # update trial counters
         # count all attempts and response trials
         self.trial_counters["attempt"] += 1
-        if np.isnan(self.outcome):
-            self.trial_counters["noresponse"] += 1
-        # if trial is valid then update valid, correct and incorrect counters
+        # if trial is valid then update valid and correct/incorrect counters (valid trials always have a response)
         if self.valid:
             self.trial_counters["valid"] += 1
-            if self.outcome == 1:
-                self.trial_counters["correct"] += 1
-            elif self.outcome == 0:
-                self.trial_counters["incorrect"] += 1
+            self.trial_counters[outcome] += 1
+        elif outcome == "noresponse":
+            self.trial_counters["noresponse"] += 1
 
         # check if next trial is correction trial
         self.is_correction_trial = False
         # if incorrect and above passive correction threshold
-        if self.outcome == 0 and np.abs(self.signed_coherence) > self.passive_bias_correction_threshold:
+        if self.outcome == 0 and abs(self.signed_coherence) > self.passive_bias_correction_threshold:
             self.is_correction_trial = True
         # if no response and no passive training
-        if np.isnan(self.choice) and self.training_type >= 2:
+        if math.isnan(self.choice) and self.training_type >= 2:
             self.is_correction_trial = True
         
         # # if responded, update rolling bias
@@ -365,23 +458,26 @@ class SessionManager:
         # if valid update trial variables and send data to terminal
         if self.valid:
             # update rolling bias
+            self._bias_sum += int(self.choice) - int(self.rolling_bias[self.rolling_bias_index])
             self.rolling_bias[self.rolling_bias_index] = self.choice
             self.rolling_bias_index = (self.rolling_bias_index + 1) % self.bias_window
             # update rolling choice history
-            idx = self.rolling_history_indices[str(self.signed_coherence)]
-            self.rolling_history[str(self.signed_coherence)][idx] = self.outcome
-            self.rolling_accuracy[str(self.signed_coherence)] = np.mean(self.rolling_history[str(self.signed_coherence)])
-            self.rolling_history_indices[str(self.signed_coherence)] = (self.rolling_history_indices[str(self.signed_coherence)] + 1) % self.rolling_window
+            ci = self._coh_idx
+            idx = self._rolling_idx[ci]
+            self._rolling_sum[ci] += self.outcome - self._rolling_hist[ci, idx]
+            self._rolling_hist[ci, idx] = self.outcome
+            self.rolling_accuracy[self._coh_str] = self._rolling_sum[ci] / self._rolling_hist.shape[1]
+            self._rolling_idx[ci] = (idx + 1) % self.rolling_window
 
             # update plot parameters
             if self.choice == -1:
                 # computing left choices coherence-wise
-                self.plot_vars["chose_left"][self.signed_coherence] += 1
+                self._chose_left[ci] += 1
             elif self.choice == 1:
                 # computing right choices coherence-wise
-                self.plot_vars["chose_right"][self.signed_coherence] += 1
+                self._chose_right[ci] += 1
                 
-            tot_trials_in_coh = self.plot_vars["chose_left"][self.signed_coherence] + self.plot_vars["chose_right"][self.signed_coherence]
+            tot_trials_in_coh = self._chose_left[ci] + self._chose_right[ci]
 
             # update running accuracy
             if (self.trial_counters["correct"] + self.trial_counters["incorrect"] > 0):
@@ -394,20 +490,13 @@ class SessionManager:
                             self.outcome
                             ]
             # update psychometric array
-            self.plot_vars["psych"][self.signed_coherence] = (
-                self.plot_vars["chose_right"][self.signed_coherence] / tot_trials_in_coh
-            )
+            self._psych[ci] = self._chose_right[ci] / tot_trials_in_coh
 
             # update total trial array
-            self.plot_vars["trial_distribution"][self.signed_coherence] += 1
+            self._trial_distribution[ci] += 1
 
-            # update reaction time array
-            if np.isnan(self.plot_vars["response_time_distribution"][self.signed_coherence]):
-                self.plot_vars["response_time_distribution"][self.signed_coherence] = self.response_time
-            else:
-                self.plot_vars["response_time_distribution"][self.signed_coherence] = (
-                    ((tot_trials_in_coh - 1) * self.plot_vars["response_time_distribution"][self.signed_coherence]) + self.response_time
-                ) / tot_trials_in_coh
+            # update reaction time array (Welford running mean)
+            self._rt_mean[ci] += (self.response_time - self._rt_mean[ci]) / self._trial_distribution[ci]
 
         trial_data = {
             "is_valid": self.valid,
@@ -417,47 +506,37 @@ class SessionManager:
             "total_reward": self.total_reward,
             "plots": {
                 "running_accuracy": self.plot_vars["running_accuracy"],
-                "psychometric_function": self.plot_vars["psych"],
-                "trial_distribution": self.plot_vars["trial_distribution"],
-                "response_time_distribution": self.plot_vars["response_time_distribution"],
+                "psychometric_function": dict(zip(self._plot_keys, self._psych.tolist())),
+                "trial_distribution": dict(zip(self._plot_keys, self._trial_distribution.tolist())),
+                "response_time_distribution": dict(
+                    zip(self._plot_keys, np.where(self._trial_distribution > 0, self._rt_mean, np.NaN).tolist())
+                ),
             }
         }
         return trial_data
 
 
     def write_trial_data_to_file(self):
-        data = {
-            "idx_attempt": self.trial_counters["attempt"],
-            "idx_valid": self.trial_counters["valid"],
-            "idx_correction": self.trial_counters["correction"],
-            "is_correction_trial": self.is_correction_trial,
-            "signed_coherence": self.signed_coherence,
-            "target": self.target,
-            "choice": self.choice,
-            "response_time": self.response_time,
-            "is_valid": self.valid,
-            "outcome": self.outcome,
-            "trial_reward": self.trial_reward,
-            "fixation_duration": self.fixation_duration,
-            "stimulus_duration": self.stimulus_duration,
-            "reinforcement_duration": self.reinforcement_duration,
-            "delay_duration": self.delay_duration,
-            "intertrial_duration": self.intertrial_duration,
-            "fixation_onset": self.fixation_onset,
-            "stimulus_onset": self.stimulus_onset,
-            "response_onset": self.response_onset,
-            "reinforcement_onset": self.reinforcement_onset,
-            "delay_onset": self.delay_onset,
-            "intertrial_onset": self.intertrial_onset,
-            "stimulus_seed": self.random_generator_seed,
-        }
-        with open(self.config.FILES["trial"], "a+", newline="") as file:
-            writer = csv.DictWriter(file, fieldnames=data.keys())
-            if file.tell() == 0:
-                writer.writeheader()
-            writer.writerow(data)        
+        # row values follow TRIAL_FIELDNAMES; the row goes into the file buffer and reaches disk on flush
+        self._trial_writer.writerow(self._trial_row_counters(self.trial_counters) + self._trial_row_values(self))
+        # flush periodically so a crash loses at most a few trials
+        self._unflushed_trials += 1
+        if self._unflushed_trials >= TRIAL_FLUSH_INTERVAL:
+            self._trial_file.flush()
+            self._unflushed_trials = 0
+
+    def close(self):
+        """Flush and close the trial data file"""
+        if not self._trial_file.closed:
+            self._trial_file.flush()
+            self._trial_file.close()
 
     def end_of_session_updates(self):
+        self.close()
+        # pack rolling history back into rolling_perf layout
+        for ci, coh_str in enumerate(self._coh_strs):
+            self.rolling_history[coh_str] = self._rolling_hist[ci].tolist()
+            self.rolling_history_indices[coh_str] = int(self._rolling_idx[ci])
         self.config.SUBJECT["rolling_perf"]["current_coherence_level"] = self.current_coh_level
         self.config.SUBJECT["rolling_perf"]["reward_volume"] = self.full_reward_volume
         self.config.SUBJECT["rolling_perf"]["total_attempts"] = self.trial_counters["attempt"]
@@ -466,9 +545,11 @@ class SessionManager:
         self.config.SUBJECT["rolling_perf"]["history_indices"] = self.rolling_history_indices
         self.config.SUBJECT["rolling_perf"]["history"] = self.rolling_history
         self.config.SUBJECT["rolling_perf"]["accuracy"] = self.rolling_accuracy
-        with open(self.config.FILES["rolling_perf_after"], "wb") as file:
-            pickle.dump(self.config.SUBJECT["rolling_perf"], file)
-        with open(self.config.FILES["rolling_perf"], "wb") as file:
-            pickle.dump(self.config.SUBJECT["rolling_perf"], file)
+        # serialize once and replace each file atomically so a crash never leaves a half-written pickle
+        rolling_perf = pickle.dumps(self.config.SUBJECT["rolling_perf"], protocol=pickle.HIGHEST_PROTOCOL)
+        for path in (self.config.FILES["rolling_perf_after"], self.config.FILES["rolling_perf"]):
+            tmp_path = path.with_name(path.name + ".tmp")
+            tmp_path.write_bytes(rolling_perf)
+            os.replace(tmp_path, path)
         print("SAVING EOS FILES")
 
@@ -1,6 +1,5 @@
 from protocols.random_dot_motion.core.stimulus.stimulus_manager import StimulusManager as core_StimulusManager
 from protocols.random_dot_motion.core.stimulus.random_dot_motion import RandomDotMotion as core_RDK
-import multiprocessing as mp
 class RandomDotMotion(core_RDK):
     """
     Class for managing stimulus structure i.e., shape, size and location of the stimuli
@@ -170,7 +170,7 @@ class Task:
         for file_id, file in self.config.DATAFILES.items():
             self.config.FILES[file_id] = Path(data_path, self.config.SUBJECT["name"] + file)
         self.config.FILES["rolling_perf_before"] = Path(data_path, "rolling_perf_before.pkl")
-        self.config.FILES["rolling_perf_before"].write_bytes(pickle.dumps(self.config.SUBJECT["rolling_perf"]))
+        self.config.FILES["rolling_perf_before"].write_bytes(pickle.dumps(self.config.SUBJECT["rolling_perf"], protocol=pickle.HIGHEST_PROTOCOL))
         self.config.FILES["rolling_perf_after"] = Path(data_path, "rolling_perf_after.pkl")
         self.config.FILES["rolling_perf"] = Path(data_path.parent, "rolling_perf.pkl")
         
@@ -203,7 +203,7 @@ if __name__ == "__main__":
     rolling_window = config.TASK["rolling_performance"]["rolling_window"]
     rolling_perf = {
                 "rolling_window": rolling_window,
-                "history": {int(coh): list(np.zeros(rolling_window).astype(int)) for coh in full_coherences},
+                "history": {int(coh): [0] * rolling_window for coh in full_coherences},
                 "history_indices": {int(coh): 0 for coh in full_coherences},
                 "accuracy": {int(coh): 0 for coh in full_coherences},
                 "current_coherence_level": current_coherence_level,
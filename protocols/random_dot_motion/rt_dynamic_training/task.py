@@ -198,7 +198,7 @@ if __name__ == "__main__":
     rolling_window = config.TASK["rolling_performance"]["rolling_window"]
     rolling_perf = {
                 "rolling_window": rolling_window,
-                "history": {int(coh): list(np.zeros(rolling_window).astype(int)) for coh in full_coherences},
+                "history": {int(coh): [0] * rolling_window for coh in full_coherences},
                 "history_indices": {int(coh): 49 for coh in full_coherences},
                 "accuracy": {int(coh): 0 for coh in full_coherences},
                 "current_coherence_level": current_coherence_level,